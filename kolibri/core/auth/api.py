@@ -24,6 +24,8 @@ from django.db.models import TextField
 from django.db.models import Value
 from django.db.models.functions import Cast
 from django.http import Http404
+from django.middleware.http import ConditionalGetMiddleware
+from django.utils.decorators import decorator_from_middleware
 from django.utils.decorators import method_decorator
 from django.utils.timezone import now
 from django.views.decorators.csrf import ensure_csrf_cookie
@@ -414,6 +416,14 @@ class PublicFacilityViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Facility.objects.all()
     serializer_class = PublicFacilitySerializer
 
+    @method_decorator(decorator_from_middleware(ConditionalGetMiddleware))
+    def list(self, request, *args, **kwargs):
+        """
+        Sends an ETag with the list, so syncing devices can revalidate a cached copy of it
+        with If-None-Match rather than downloading it again
+        """
+        return super(PublicFacilityViewSet, self).list(request, *args, **kwargs)
+
 
 class ClassroomFilter(FilterSet):
 
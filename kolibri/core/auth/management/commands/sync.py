@@ -1,7 +1,7 @@
 import json
 import logging
-import math
 import re
+import time
 from contextlib import contextmanager
 
 from django.core.management import call_command
@@ -16,6 +16,7 @@ from ..utils import get_baseurl
 from ..utils import get_client_and_server_certs
 from ..utils import get_dataset_id
 from ..utils import get_single_user_sync_filter
+from ..utils import get_single_user_sync_scope
 from ..utils import provision_single_user_device
 from kolibri.core.auth.constants.morango_sync import PROFILE_FACILITY_DATA
 from kolibri.core.auth.constants.morango_sync import ScopeDefinitions
@@ -31,6 +32,9 @@ from kolibri.utils import conf
 
 DATA_PORTAL_SYNCING_BASE_URL = conf.OPTIONS["Urls"]["DATA_PORTAL_SYNCING_BASE_URL"]
 TRANSFER_MESSAGE = "{records_transferred}/{records_total}, {transfer_total}"
+# minimum number of seconds between formatting progress messages during a transfer
+TRANSFER_MESSAGE_INTERVAL = 0.1
+USER_ID_PATTERN = re.compile(r"[a-f0-9]{32}\Z")
 
 
 logger = logging.getLogger(__name__)
@@ -139,11 +143,14 @@ class Command(AsyncCommand):
                 raise CommandError(
                     "Facility ID must be specified in order to do single-user syncing"
                 )
-            if not re.match("[a-f0-9]{32}", user_id):
+            if not USER_ID_PATTERN.match(user_id):
                 raise CommandError("User ID must be a 32-character UUID (no dashes)")
 
             dataset_id = get_dataset_id(
-                baseurl, identifier=facility_id, noninteractive=True
+                baseurl,
+                identifier=facility_id,
+                noninteractive=True,
+                session=network_connection.session,
             )
 
             client_cert, server_cert, username = get_client_and_server_certs(
@@ -202,7 +209,10 @@ class Command(AsyncCommand):
 
         else:  # do P2P setup
             dataset_id = get_dataset_id(
-                baseurl, identifier=facility_id, noninteractive=noninteractive
+                baseurl,
+                identifier=facility_id,
+                noninteractive=noninteractive,
+                session=network_connection.session,
             )
 
             client_cert, server_cert, username = get_client_and_server_certs(
@@ -213,6 +223,11 @@ class Command(AsyncCommand):
                 noninteractive=noninteractive,
             )
 
+        # build the single-user scope once, for both pulling and pushing
+        single_user_scope = (
+            get_single_user_sync_scope(dataset_id, user_id) if user_id else None
+        )
+
         logger.info("Syncing has been initiated (this may take a while)...")
         sync_session_client = network_connection.create_sync_session(
             client_cert, server_cert, chunk_size=chunk_size
@@ -228,6 +243,7 @@ class Command(AsyncCommand):
                     client_cert,
                     server_cert,
                     user_id=user_id,
+                    single_user_scope=single_user_scope,
                 )
             # and push our own data to server
             if not no_push:
@@ -238,6 +254,7 @@ class Command(AsyncCommand):
                     client_cert,
                     server_cert,
                     user_id=user_id,
+                    single_user_scope=single_user_scope,
                 )
 
             if not no_provision:
@@ -291,11 +308,13 @@ class Command(AsyncCommand):
         client_cert,
         server_cert,
         user_id,
+        single_user_scope=None,
     ):
         """
         :type sync_session_client: morango.sync.syncsession.SyncSessionClient
         :type noninteractive: bool
         :type dataset_id: str
+        :type single_user_scope: morango.models.certificates.Scope
         """
         sync_client = sync_session_client.get_pull_client()
         sync_client.signals.queuing.connect(self._raise_cancel)
@@ -335,7 +354,10 @@ class Command(AsyncCommand):
                 client_cert.scope_definition_id == ScopeDefinitions.SINGLE_USER
             )
             filt = get_single_user_sync_filter(
-                dataset_id, user_id, is_read=client_is_single_user
+                dataset_id,
+                user_id,
+                is_read=client_is_single_user,
+                scope=single_user_scope,
             )
             sync_client.initialize(Filter(filt))
 
@@ -351,11 +373,13 @@ class Command(AsyncCommand):
         client_cert,
         server_cert,
         user_id,
+        single_user_scope=None,
     ):
         """
         :type sync_session_client: morango.sync.syncsession.SyncSessionClient
         :type noninteractive: bool
         :type dataset_id: str
+        :type single_user_scope: morango.models.certificates.Scope
         """
         sync_client = sync_session_client.get_push_client()
         sync_client.signals.transferring.connect(self._raise_cancel)
@@ -395,7 +419,10 @@ class Command(AsyncCommand):
                     client_cert.scope_definition_id == ScopeDefinitions.SINGLE_USER
                 )
                 filt = get_single_user_sync_filter(
-                    dataset_id, user_id, is_read=not client_is_single_user
+                    dataset_id,
+                    user_id,
+                    is_read=not client_is_single_user,
+                    scope=single_user_scope,
                 )
                 sync_client.initialize(Filter(filt))
 
@@ -457,32 +484,58 @@ class Command(AsyncCommand):
         :type noninteractive: bool
         """
         tracker = self.start_progress(total=100)
+        # the last stats message and when it was formatted, and when in-progress stats were last
+        # logged, in lists since there's no `nonlocal` in python 2
+        last_stats_msg = [None, 0]
+        last_stats_log = [0]
+
+        def stats_msg(transfer_session, throttle=False):
+            now = time.time()
+            # reuse the recent message while in progress, but always report the final stats
+            if (
+                throttle
+                and last_stats_msg[0] is not None
+                and now - last_stats_msg[1] < TRANSFER_MESSAGE_INTERVAL
+                and transfer_session.records_transferred
+                < transfer_session.records_total
+            ):
+                return last_stats_msg[0]
 
-        def stats_msg(transfer_session):
             transfer_total = (
                 transfer_session.bytes_sent + transfer_session.bytes_received
             )
-            return message.format(
-                records_transferred=transfer_session.records_transferred,
-                records_total=transfer_session.records_total,
-                transfer_total=bytes_for_humans(transfer_total),
-            )
+            last_stats_msg[:] = [
+                message.format(
+                    records_transferred=transfer_session.records_transferred,
+                    records_total=transfer_session.records_total,
+                    transfer_total=bytes_for_humans(transfer_total),
+                ),
+                now,
+            ]
+            return last_stats_msg[0]
 
         def stats(transfer_session):
             logger.info(stats_msg(transfer_session))
 
+        def in_progress_stats(transfer_session):
+            now = time.time()
+            if now - last_stats_log[0] < TRANSFER_MESSAGE_INTERVAL:
+                return
+            last_stats_log[0] = now
+            stats(transfer_session)
+
         def handler(transfer_session):
             """
             :type transfer_session: morango.models.core.TransferSession
             """
+            # percentage of records transferred, rounded up using integer math
+            records_total = max(transfer_session.records_total, 1)
             progress = (
-                100
-                * transfer_session.records_transferred
-                / float(transfer_session.records_total)
-            )
+                100 * transfer_session.records_transferred + records_total - 1
+            ) // records_total
             tracker.update_progress(
-                increment=math.ceil(progress - tracker.progress),
-                message=stats_msg(transfer_session),
+                increment=progress - tracker.progress,
+                message=stats_msg(transfer_session, throttle=True),
                 extra_data=dict(
                     bytes_sent=transfer_session.bytes_sent,
                     bytes_received=transfer_session.bytes_received,
@@ -492,7 +545,7 @@ class Command(AsyncCommand):
 
         if noninteractive or tracker.progressbar is None:
             signal_group.started.connect(stats)
-            signal_group.in_progress.connect(stats)
+            signal_group.in_progress.connect(in_progress_stats)
 
         signal_group.connect(handler)
 
@@ -522,9 +575,6 @@ class Command(AsyncCommand):
                 message=message, extra_data=dict(sync_state=sync_state)
             )
 
-        if noninteractive or tracker.progressbar is None:
-            signal_group.started.connect(started)
-
         signal_group.started.connect(started)
         signal_group.started.connect(handler)
         signal_group.completed.connect(handler)
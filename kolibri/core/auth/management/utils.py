@@ -4,10 +4,16 @@ Utility methods for syncing.
 import getpass
 import logging
 import time
+import weakref
+from collections import OrderedDict
 from functools import wraps
 
 import requests
+from django.core.exceptions import EmptyResultSet
 from django.core.management.base import CommandError
+from django.db import connections
+from django.db.models import Q
+from django.db.models.deletion import Collector
 from django.db.models.signals import post_delete
 from django.urls import reverse
 from django.utils.six.moves import input
@@ -24,10 +30,20 @@ from kolibri.core.device.utils import provision_device
 from kolibri.core.discovery.utils.network.client import NetworkClient
 from kolibri.core.discovery.utils.network.errors import NetworkLocationNotFound
 from kolibri.core.discovery.utils.network.errors import URLParseError
+from kolibri.core.utils.cache import process_cache
 
 
 logger = logging.getLogger(__name__)
 
+# SQLite's default limit on the number of parameters bound to a single query
+MAX_COUNT_QUERY_PARAMS = 999
+
+# number of objects to delete per query when deletions need to be collected for cascading
+DELETE_CHUNK_SIZE = 10000
+
+FACILITY_LIST_CACHE_KEY = "facility_list_cache_{url}"
+FACILITY_LIST_FIELDS = ("id", "dataset", "name")
+
 
 class DisablePostDeleteSignal(object):
     """
@@ -36,23 +52,31 @@ class DisablePostDeleteSignal(object):
     """
 
     def __enter__(self):
-        self.receivers = post_delete.receivers
-        post_delete.receivers = []
+        # the signal caches receivers per sender, so swap out the cache along with the receivers,
+        # otherwise cached receivers are still considered listeners while disabled, and senders
+        # cached as having no receivers while disabled would remain so afterwards
+        with post_delete.lock:
+            self.receivers = post_delete.receivers
+            self.receivers_cache = post_delete.sender_receivers_cache
+            post_delete.receivers = []
+            post_delete.sender_receivers_cache = weakref.WeakKeyDictionary()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        post_delete.receivers = self.receivers
+        with post_delete.lock:
+            post_delete.receivers = self.receivers
+            post_delete.sender_receivers_cache = self.receivers_cache
         self.receivers = None
+        self.receivers_cache = None
 
 
 def _interactive_client_facility_selection():
-    facilities = Facility.objects.all().order_by("name")
+    # only fetch what's needed to list the facilities, and fetch the selected one in full
+    facilities = list(Facility.objects.order_by("name").values_list("id", "name"))
     message = "Please choose a facility:\n"
-    for idx, facility in enumerate(facilities):
-        message += "{}. {}\n".format(idx + 1, facility.name)
+    for idx, (_, name) in enumerate(facilities):
+        message += "{}. {}\n".format(idx + 1, name)
     idx = input(message)
-    try:
-        facility = facilities[int(idx) - 1]
-    except IndexError:
+    if not 0 < int(idx) <= len(facilities):
         raise CommandError(
             (
                 "{idx} is not in the range of (1, {range})".format(
@@ -60,7 +84,8 @@ def _interactive_client_facility_selection():
                 )
             )
         )
-    return facility
+    facility_id, _ = facilities[int(idx) - 1]
+    return Facility.objects.get(id=facility_id)
 
 
 def _interactive_server_facility_selection(facilities):
@@ -114,12 +139,47 @@ def get_facility(facility_id=None, noninteractive=False):
     return facility
 
 
-def get_dataset_id(baseurl, identifier=None, noninteractive=False):
-    # get list of facilities and if more than 1, display all choices to user
+def get_facilities(baseurl, session=None):
+    """
+    Fetches the list of public facilities from the server, revalidating a previously cached list
+    with its ETag so unchanged lists aren't downloaded again. An existing session with the server
+    can be passed in, so its connections are reused
+
+    :type baseurl: str
+    :type session: requests.Session
+    :rtype: list
+    """
     facility_url = urljoin(baseurl, reverse("kolibri:core:publicfacility-list"))
-    response = requests.get(facility_url)
+    cache_key = FACILITY_LIST_CACHE_KEY.format(url=facility_url)
+    cached = process_cache.get(cache_key)
+
+    headers = {}
+    if cached is not None:
+        headers["If-None-Match"] = cached["etag"]
+
+    get = session.get if session is not None else requests.get
+    response = get(facility_url, headers=headers)
+    if cached is not None and response.status_code == 304:
+        return cached["facilities"]
+
     response.raise_for_status()
-    facilities = response.json()
+    # only keep the fields we use, so there's no more than that held in the cache
+    facilities = [
+        {field: facility.get(field) for field in FACILITY_LIST_FIELDS}
+        for facility in response.json()
+    ]
+
+    etag = response.headers.get("ETag")
+    if etag:
+        process_cache.set(cache_key, {"etag": etag, "facilities": facilities})
+    elif cached is not None:
+        process_cache.delete(cache_key)
+    return facilities
+
+
+def get_dataset_id(baseurl, identifier=None, noninteractive=False, session=None):
+    # get list of facilities and if more than 1, display all choices to user
+    facilities = get_facilities(baseurl, session=session)
     if not facilities:
         raise CommandError("There are no facilities available at: {}".format(baseurl))
     # if provided, look up identifier in list of dataset and facility ids
@@ -163,11 +223,11 @@ def get_client_and_server_certs(
     username, password, dataset_id, nc, user_id=None, noninteractive=False
 ):
 
-    # get any full-facility certificates we have for the facility
+    # get the ids of any certificates we own for the facility, in a single descendant traversal,
+    # leaving the owned certificate we end up using to be fetched in full afterwards
     owned_certs = (
         Certificate.objects.filter(id=dataset_id)
         .get_descendants(include_self=True)
-        .filter(scope_definition_id=ScopeDefinitions.FULL_FACILITY)
         .exclude(_private_key=None)
     )
 
@@ -178,27 +238,45 @@ def get_client_and_server_certs(
         client_scope = ScopeDefinitions.FULL_FACILITY
         server_scope = ScopeDefinitions.FULL_FACILITY
 
+        owned_cert_ids = list(
+            owned_certs.filter(
+                scope_definition_id=ScopeDefinitions.FULL_FACILITY
+            ).values_list("id", flat=True)
+        )
+
     else:  # it's a single-user sync
 
         csr_scope_params = {"dataset_id": dataset_id, "user_id": user_id}
 
-        if owned_certs:
+        # fetch full-facility certs along with certs for the specific user_id for
+        # single-user syncing, then split them up by scope. Morango stores `scope_params` as
+        # serialized JSON text, so the user is matched by substring, but only within this
+        # facility's certificate subtree, which MPTT narrows with its indexed tree fields
+        owned_certs = list(
+            owned_certs.filter(
+                Q(scope_definition_id=ScopeDefinitions.FULL_FACILITY)
+                | Q(
+                    scope_definition_id=ScopeDefinitions.SINGLE_USER,
+                    scope_params__contains=user_id,
+                )
+            ).values_list("id", "scope_definition_id")
+        )
+        full_facility_cert_ids = [
+            cert_id
+            for cert_id, scope_definition_id in owned_certs
+            if scope_definition_id == ScopeDefinitions.FULL_FACILITY
+        ]
+
+        if full_facility_cert_ids:
             # client is the one with a full-facility cert
             client_scope = ScopeDefinitions.FULL_FACILITY
             server_scope = ScopeDefinitions.SINGLE_USER
+            owned_cert_ids = full_facility_cert_ids
         else:
             # server must be the one with the full-facility cert
             client_scope = ScopeDefinitions.SINGLE_USER
             server_scope = ScopeDefinitions.FULL_FACILITY
-
-            # check for certs we own for the specific user_id for single-user syncing
-            owned_certs = (
-                Certificate.objects.filter(id=dataset_id)
-                .get_descendants(include_self=True)
-                .filter(scope_definition_id=ScopeDefinitions.SINGLE_USER)
-                .filter(scope_params__contains=user_id)
-                .exclude(_private_key=None)
-            )
+            owned_cert_ids = [cert_id for cert_id, _ in owned_certs]
 
     # get server certificates that server has a private key for
     server_certs = nc.get_remote_certificates(dataset_id, scope_def_id=server_scope)
@@ -216,7 +294,7 @@ def get_client_and_server_certs(
     server_cert = server_certs[0]
 
     # if we don't own any certs, do a csr request
-    if not owned_certs:
+    if not owned_cert_ids:
 
         # prompt user for creds if not already specified
         if not username or not password:
@@ -234,7 +312,9 @@ def get_client_and_server_certs(
             password=password,
         )
     else:
-        client_cert = owned_certs[0]
+        client_cert = Certificate.objects.select_related("parent").get(
+            id=owned_cert_ids[0]
+        )
 
     return client_cert, server_cert, username
 
@@ -246,7 +326,8 @@ def create_superuser_and_provision_device(username, dataset_id, noninteractive=F
         provision_device(default_facility=facility)
 
     # Prompt user to pick a superuser if one does not currently exist
-    while not DevicePermissions.objects.filter(is_superuser=True).exists():
+    has_superuser = DevicePermissions.objects.filter(is_superuser=True).exists()
+    while not has_superuser:
         # specify username of account that will become a superuser
         if not username:
             if (
@@ -267,20 +348,22 @@ def create_superuser_and_provision_device(username, dataset_id, noninteractive=F
             username = input(
                 "Please enter username of account that will become the superuser on this device: "
             )
-        if not FacilityUser.objects.filter(username=username).exists():
+
+        # make the user with the given credentials, a superuser for this device
+        try:
+            user = FacilityUser.objects.get(username=username, dataset_id=dataset_id)
+        except FacilityUser.DoesNotExist:
             print(
                 "User with username `{}` does not exist on this device".format(username)
             )
             username = None
             continue
 
-        # make the user with the given credentials, a superuser for this device
-        user = FacilityUser.objects.get(username=username, dataset_id=dataset_id)
-
         # create permissions for the authorized user
         DevicePermissions.objects.update_or_create(
             user=user, defaults={"is_superuser": True, "can_manage_content": True}
         )
+        has_superuser = True
 
 
 def provision_single_user_device(user_id):
@@ -296,9 +379,26 @@ def provision_single_user_device(user_id):
     )
 
 
-def get_single_user_sync_filter(dataset_id, user_id, is_read):
+def get_single_user_sync_scope(dataset_id, user_id):
+    """
+    :type dataset_id: str
+    :type user_id: str
+    :rtype: morango.models.certificates.Scope
+    """
     scopedef = ScopeDefinition.objects.get(id=ScopeDefinitions.SINGLE_USER)
-    scope = scopedef.get_scope({"dataset_id": dataset_id, "user_id": user_id})
+    return scopedef.get_scope({"dataset_id": dataset_id, "user_id": user_id})
+
+
+def get_single_user_sync_filter(dataset_id, user_id, is_read, scope=None):
+    """
+    :type dataset_id: str
+    :type user_id: str
+    :type is_read: bool
+    :type scope: morango.models.certificates.Scope
+    :rtype: str
+    """
+    if scope is None:
+        scope = get_single_user_sync_scope(dataset_id, user_id)
     if is_read:
         return str(scope.read_filter)
     else:
@@ -323,6 +423,101 @@ def run_once(f):
     return wrapper
 
 
+def _get_count_subquery(qs):
+    """
+    Compiles a queryset into a `SELECT COUNT(*)` subquery that can be selected alongside others
+
+    :type qs: QuerySet
+    :rtype: tuple(str, tuple)
+    """
+    sql, params = qs.order_by().values("pk").query.get_compiler(using=qs.db).as_sql()
+    return "(SELECT COUNT(*) FROM ({}) AS count_subquery)".format(sql), params
+
+
+def _count_querysets(querysets):
+    """
+    Counts each of the querysets, selecting the counts of querysets that share a database
+    together in a single query rather than issuing a `COUNT` query per queryset
+
+    :type querysets: QuerySet[]
+    :rtype: int[]
+    """
+    counts = [None] * len(querysets)
+    subqueries_by_db = OrderedDict()
+
+    for index, qs in enumerate(querysets):
+        if not qs.query.can_filter() or qs.query.annotations:
+            # sliced or annotated querysets don't translate to a simple subquery
+            counts[index] = qs.count()
+            continue
+        try:
+            sql, params = _get_count_subquery(qs)
+        except EmptyResultSet:
+            counts[index] = 0
+            continue
+        subqueries_by_db.setdefault(qs.db, []).append((index, sql, params))
+
+    for db, subqueries in subqueries_by_db.items():
+        # split into batches that stay within the parameter limit
+        batches = [[]]
+        batch_param_count = 0
+        for subquery in subqueries:
+            param_count = len(subquery[2])
+            if batches[-1] and batch_param_count + param_count > MAX_COUNT_QUERY_PARAMS:
+                batches.append([])
+                batch_param_count = 0
+            batches[-1].append(subquery)
+            batch_param_count += param_count
+
+        for batch in batches:
+            sql = "SELECT {}".format(", ".join(subquery for _, subquery, _ in batch))
+            params = [
+                param for _, _, subquery_params in batch for param in subquery_params
+            ]
+            with connections[db].cursor() as cursor:
+                cursor.execute(sql, params)
+                for (index, _, _), count in zip(batch, cursor.fetchone()):
+                    counts[index] = count
+
+    return counts
+
+
+def _delete_queryset(qs, sleep=None):
+    """
+    Deletes the queryset, in chunks when Django's deletion collector would otherwise need to load
+    every object into memory to look for cascades
+
+    :type qs: QuerySet
+    :type sleep: int
+    :rtype: tuple(int, dict)
+    """
+    # with nothing to cascade to, Django deletes the queryset with a single DELETE query
+    if Collector(using=qs.db).can_fast_delete(qs):
+        return qs.delete()
+
+    total_count = 0
+    all_deletions = dict()
+    model_label = qs.model._meta.label
+    pks = qs.order_by().values("pk")
+
+    while True:
+        # like Django's deletion collector, use the base manager so none of the rows are filtered
+        count, deletions = qs.model._base_manager.filter(
+            pk__in=pks[:DELETE_CHUNK_SIZE]
+        ).delete()
+
+        total_count += count
+        for obj_name, obj_count in deletions.items():
+            all_deletions.update({obj_name: all_deletions.get(obj_name, 0) + obj_count})
+
+        if deletions.get(model_label, 0) < DELETE_CHUNK_SIZE:
+            break
+        if sleep is not None:
+            time.sleep(sleep)
+
+    return total_count, all_deletions
+
+
 class GroupDeletion(object):
     """
     Helper to manage deleting many models, or groups of models
@@ -340,6 +535,7 @@ class GroupDeletion(object):
             groups.extend(querysets)
         self.groups = groups
         self.sleep = sleep
+        self._group_count = None
 
     def count(self, progress_updater):
         """
@@ -347,12 +543,15 @@ class GroupDeletion(object):
         :rtype: int
         """
         sum = 0
+        querysets = [qs for qs in self.groups if not isinstance(qs, GroupDeletion)]
+        queryset_counts = dict(zip(map(id, querysets), _count_querysets(querysets)))
+
         for qs in self.groups:
             if isinstance(qs, GroupDeletion):
                 count = qs.count(progress_updater)
                 logger.debug("Counted {} in group `{}`".format(count, qs.name))
             else:
-                count = qs.count()
+                count = queryset_counts[id(qs)]
                 progress_updater(increment=1)
                 logger.debug(
                     "Counted {} of `{}`".format(count, qs.model._meta.model_name)
@@ -366,12 +565,14 @@ class GroupDeletion(object):
         """
         :rtype: int
         """
-        return sum(
-            [
-                qs.group_count() if isinstance(qs, GroupDeletion) else 1
-                for qs in self.groups
-            ]
-        )
+        if self._group_count is None:
+            self._group_count = sum(
+                [
+                    qs.group_count() if isinstance(qs, GroupDeletion) else 1
+                    for qs in self.groups
+                ]
+            )
+        return self._group_count
 
     def delete(self, progress_updater, sleep=None):
         """
@@ -389,7 +590,7 @@ class GroupDeletion(object):
                 debug_msg = "Deleted {} of `{}` in group `{}`"
                 name = qs.name
             else:
-                count, deletions = qs.delete()
+                count, deletions = _delete_queryset(qs, sleep=sleep)
                 debug_msg = "Deleted {} of `{}` with model `{}`"
                 name = qs.model._meta.model_name
 
@@ -458,6 +458,22 @@ class FacilityAPITestCase(APITestCase):
         response = self.client.get(reverse("kolibri:core:publicfacility-list"))
         self.assertEqual(models.Facility.objects.all().count(), len(response.data))
 
+    def test_public_facility_endpoint_etag(self):
+        response = self.client.get(reverse("kolibri:core:publicfacility-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        response = self.client.get(
+            reverse("kolibri:core:publicfacility-list"), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        models.Facility.objects.create(name="new facility")
+        response = self.client.get(
+            reverse("kolibri:core:publicfacility-list"), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 
 class UserCreationTestCase(APITestCase):
     @classmethod
@@ -2,14 +2,25 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import uuid
 
 import mock
+from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db.models.signals import post_delete
+from django.test import SimpleTestCase
 from django.test import TestCase
+from morango.models import Certificate
+from morango.models.fields.crypto import Key
 
+from ..constants.morango_sync import ScopeDefinitions
 from ..models import Facility
+from ..models import FacilityUser
 from kolibri.core.auth.management import utils
+from kolibri.core.device.models import DevicePermissions
+from kolibri.core.discovery.utils.network.errors import NetworkLocationNotFound
+from kolibri.core.utils.cache import process_cache
 
 
 class GetFacilityTestCase(TestCase):
@@ -45,8 +56,262 @@ class GetFacilityTestCase(TestCase):
         Facility.objects.create(name="b_facility")
         self.assertEqual(self.facility, utils.get_facility())
 
+    @mock.patch("kolibri.core.auth.management.utils.input", return_value="0")
+    def test_get_facility_multiple_facilities_interactive_out_of_range(
+        self, input_mock
+    ):
+        Facility.objects.create(name="a_facility")
+        with self.assertRaisesRegexp(CommandError, "not in the range"):
+            utils.get_facility()
+
 
 class GetFacilityFailureTestCase(TestCase):
     def test_get_facility_no_facilities(self):
         with self.assertRaisesRegexp(CommandError, "no facilities"):
             utils.get_facility()
+
+
+class GroupDeletionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.facility = Facility.objects.create(name="facility")
+        for username in ("a", "b", "c"):
+            FacilityUser.objects.create(username=username, facility=cls.facility)
+
+    def _get_group(self):
+        return utils.GroupDeletion(
+            "Main",
+            groups=[
+                utils.GroupDeletion(
+                    "Users",
+                    querysets=[
+                        FacilityUser.objects.filter(facility=self.facility),
+                        FacilityUser.objects.filter(username="a"),
+                    ],
+                ),
+                Facility.objects.all(),
+                FacilityUser.objects.filter(pk__in=[]),
+                FacilityUser.objects.all()[:2],
+            ],
+        )
+
+    def test_group_count(self):
+        group = self._get_group()
+        self.assertEqual(5, group.group_count())
+        self.assertEqual(5, group.group_count())
+
+    def test_count(self):
+        progress_updater = mock.Mock()
+        self.assertEqual(7, self._get_group().count(progress_updater))
+        self.assertEqual(5, progress_updater.call_count)
+
+    @mock.patch("kolibri.core.auth.management.utils.MAX_COUNT_QUERY_PARAMS", 1)
+    def test_count__batched(self):
+        progress_updater = mock.Mock()
+        self.assertEqual(7, self._get_group().count(progress_updater))
+        self.assertEqual(5, progress_updater.call_count)
+
+    def test_delete(self):
+        progress_updater = mock.Mock()
+        group = utils.GroupDeletion(
+            "Users", querysets=[FacilityUser.objects.filter(facility=self.facility)]
+        )
+        count, deletions = group.delete(progress_updater)
+        self.assertEqual(3, deletions[FacilityUser._meta.label])
+        self.assertEqual(count, sum(deletions.values()))
+        self.assertFalse(FacilityUser.objects.exists())
+
+    @mock.patch("kolibri.core.auth.management.utils.DELETE_CHUNK_SIZE", 2)
+    def test_delete__chunked(self):
+        progress_updater = mock.Mock()
+        group = utils.GroupDeletion(
+            "Users", querysets=[FacilityUser.objects.filter(facility=self.facility)]
+        )
+        count, deletions = group.delete(progress_updater)
+        self.assertEqual(3, deletions[FacilityUser._meta.label])
+        self.assertEqual(count, sum(deletions.values()))
+        self.assertFalse(FacilityUser.objects.exists())
+
+
+@mock.patch(
+    "kolibri.core.auth.management.utils.reverse", return_value="/api/public/facility/"
+)
+@mock.patch("kolibri.core.auth.management.utils.requests.get")
+class GetFacilitiesTestCase(SimpleTestCase):
+    def setUp(self):
+        process_cache.clear()
+        self.facilities = [{"id": "abc", "dataset": "def", "name": "facility"}]
+
+    def tearDown(self):
+        process_cache.clear()
+
+    def _mock_response(self, status_code=200, etag=None):
+        response = mock.Mock(status_code=status_code, headers={})
+        response.json.return_value = self.facilities
+        if etag:
+            response.headers["ETag"] = etag
+        return response
+
+    def test_get_facilities(self, get_mock, reverse_mock):
+        get_mock.return_value = self._mock_response()
+        self.assertEqual(self.facilities, utils.get_facilities("http://test.com"))
+        get_mock.assert_called_once_with(mock.ANY, headers={})
+
+    def test_get_facilities__extra_fields(self, get_mock, reverse_mock):
+        get_mock.return_value = self._mock_response()
+        get_mock.return_value.json.return_value = [
+            dict(self.facilities[0], extra="value")
+        ]
+        self.assertEqual(self.facilities, utils.get_facilities("http://test.com"))
+
+    def test_get_facilities__not_modified(self, get_mock, reverse_mock):
+        get_mock.return_value = self._mock_response(etag='"123"')
+        self.assertEqual(self.facilities, utils.get_facilities("http://test.com"))
+
+        get_mock.reset_mock()
+        get_mock.return_value = self._mock_response(status_code=304)
+        self.assertEqual(self.facilities, utils.get_facilities("http://test.com"))
+        get_mock.assert_called_once_with(mock.ANY, headers={"If-None-Match": '"123"'})
+        get_mock.return_value.json.assert_not_called()
+
+    def test_get_facilities__session(self, get_mock, reverse_mock):
+        session = mock.Mock()
+        session.get.return_value = self._mock_response()
+        self.assertEqual(
+            self.facilities, utils.get_facilities("http://test.com", session=session)
+        )
+        session.get.assert_called_once_with(mock.ANY, headers={})
+        get_mock.assert_not_called()
+
+
+class DisablePostDeleteSignalTestCase(SimpleTestCase):
+    def test_disables_cached_receivers(self):
+        # warm the signal's receivers cache for the sender
+        self.assertTrue(post_delete.has_listeners(FacilityUser))
+        with utils.DisablePostDeleteSignal():
+            self.assertFalse(post_delete.has_listeners(FacilityUser))
+        self.assertTrue(post_delete.has_listeners(FacilityUser))
+
+    def test_restores_receivers(self):
+        with utils.DisablePostDeleteSignal():
+            # cache the sender as having no receivers while disabled
+            self.assertFalse(post_delete.has_listeners(Facility))
+        self.assertTrue(post_delete.has_listeners(Facility))
+
+
+@mock.patch("kolibri.core.auth.management.utils.NetworkClient")
+class GetBaseurlTestCase(SimpleTestCase):
+    def test_get_baseurl__not_found(self, client_mock):
+        client_mock.side_effect = NetworkLocationNotFound()
+        with self.assertRaisesRegexp(CommandError, "Unable to connect"):
+            utils.get_baseurl("test.com")
+
+
+class CreateSuperuserAndProvisionDeviceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.facility = Facility.objects.create(name="facility")
+        cls.user = FacilityUser.objects.create(username="admin", facility=cls.facility)
+
+    @mock.patch("kolibri.core.auth.management.utils.print")
+    @mock.patch(
+        "kolibri.core.auth.management.utils.input", side_effect=["nobody", "admin"]
+    )
+    def test_prompts_until_user_exists(self, input_mock, print_mock):
+        utils.create_superuser_and_provision_device(None, self.facility.dataset_id)
+        self.assertEqual(2, input_mock.call_count)
+        self.assertTrue(
+            DevicePermissions.objects.filter(user=self.user, is_superuser=True).exists()
+        )
+
+
+class GetClientAndServerCertsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("loaddata", "scopedefinitions")
+        cls.facility = Facility.objects.create(name="facility")
+        cls.dataset_id = cls.facility.dataset_id
+        cls.user_id = uuid.uuid4().hex
+        cls.other_user_id = uuid.uuid4().hex
+        cls.root_cert = Certificate.objects.get(id=cls.dataset_id)
+
+    def setUp(self):
+        self.nc = mock.Mock()
+        self.server_cert = mock.Mock(
+            scope_params=json.dumps(
+                {"dataset_id": self.dataset_id, "user_id": self.user_id}
+            )
+        )
+        self.nc.get_remote_certificates.return_value = [self.server_cert]
+
+    def _create_single_user_cert(self, user_id):
+        cert = Certificate(
+            parent=self.root_cert,
+            profile=self.root_cert.profile,
+            scope_definition_id=ScopeDefinitions.SINGLE_USER,
+            scope_version=1,
+            scope_params=json.dumps(
+                {"dataset_id": self.dataset_id, "user_id": user_id}
+            ),
+        )
+        cert.private_key = Key()
+        cert.id = cert.calculate_uuid()
+        self.root_cert.sign_certificate(cert)
+        cert.save()
+        return cert
+
+    def _disown_root_cert(self):
+        Certificate.objects.filter(id=self.dataset_id).update(_private_key=None)
+
+    def test_full_facility__owned(self):
+        client_cert, server_cert, _ = utils.get_client_and_server_certs(
+            "user", "pass", self.dataset_id, self.nc
+        )
+        self.assertEqual(self.root_cert, client_cert)
+        self.assertEqual(self.server_cert, server_cert)
+        self.nc.get_remote_certificates.assert_called_once_with(
+            self.dataset_id, scope_def_id=ScopeDefinitions.FULL_FACILITY
+        )
+        self.nc.certificate_signing_request.assert_not_called()
+
+    def test_single_user__owned_full_facility(self):
+        self._create_single_user_cert(self.user_id)
+        client_cert, server_cert, _ = utils.get_client_and_server_certs(
+            "user", "pass", self.dataset_id, self.nc, user_id=self.user_id
+        )
+        self.assertEqual(self.root_cert, client_cert)
+        self.assertEqual(self.server_cert, server_cert)
+        self.nc.get_remote_certificates.assert_called_once_with(
+            self.dataset_id, scope_def_id=ScopeDefinitions.SINGLE_USER
+        )
+        self.nc.certificate_signing_request.assert_not_called()
+
+    def test_single_user__owned_single_user(self):
+        self._create_single_user_cert(self.other_user_id)
+        cert = self._create_single_user_cert(self.user_id)
+        self._disown_root_cert()
+        client_cert, server_cert, _ = utils.get_client_and_server_certs(
+            "user", "pass", self.dataset_id, self.nc, user_id=self.user_id
+        )
+        self.assertEqual(cert, client_cert)
+        self.assertEqual(self.server_cert, server_cert)
+        self.nc.get_remote_certificates.assert_called_once_with(
+            self.dataset_id, scope_def_id=ScopeDefinitions.FULL_FACILITY
+        )
+        self.nc.certificate_signing_request.assert_not_called()
+
+    def test_none_owned(self):
+        self._disown_root_cert()
+        client_cert, server_cert, username = utils.get_client_and_server_certs(
+            "user", "pass", self.dataset_id, self.nc
+        )
+        self.assertEqual(self.nc.certificate_signing_request.return_value, client_cert)
+        self.assertEqual(self.server_cert, server_cert)
+        self.assertEqual("user", username)
+        self.nc.certificate_signing_request.assert_called_once_with(
+            self.server_cert,
+            ScopeDefinitions.FULL_FACILITY,
+            {"dataset_id": self.dataset_id},
+            userargs="user",
+            password="pass",
+        )
@@ -1,4 +1,5 @@
 import unittest
+from sqlite3 import OperationalError
 
 import mock
 from django.conf import settings
@@ -58,6 +59,39 @@ class DBBasedProcessLockTestCase(SimpleTestCase):
             pass
         self.assertFalse(SQLiteLock.objects.all().exists())
 
+    @unittest.skipIf(
+        getattr(settings, "DATABASES")["default"]["ENGINE"]
+        != "django.db.backends.sqlite3",
+        "SQLite only test",
+    )
+    def test_sqlite_locking__nested(self):
+        with db_lock():
+            with db_lock():
+                self.assertEqual(1, SQLiteLock.objects.all().count())
+            self.assertTrue(SQLiteLock.objects.all().exists())
+        self.assertFalse(SQLiteLock.objects.all().exists())
+
+    @unittest.skipIf(
+        getattr(settings, "DATABASES")["default"]["ENGINE"]
+        != "django.db.backends.sqlite3",
+        "SQLite only test",
+    )
+    @mock.patch("kolibri.core.utils.lock.time.sleep")
+    @mock.patch("kolibri.core.utils.lock.DummyOperation.execute")
+    def test_sqlite_locking__backoff(self, execute_mock, sleep_mock):
+        execute_mock.side_effect = [
+            OperationalError("database is locked"),
+            OperationalError("database is locked"),
+            None,
+        ]
+        with db_lock():
+            pass
+        self.assertEqual(3, execute_mock.call_count)
+        self.assertEqual(2, sleep_mock.call_count)
+        first_delay = sleep_mock.call_args_list[0][0][0]
+        second_delay = sleep_mock.call_args_list[1][0][0]
+        self.assertLess(first_delay, second_delay)
+
 
 class RedisSettingsHelperTestCase(TestCase):
     def setUp(self):
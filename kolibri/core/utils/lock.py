@@ -1,3 +1,6 @@
+import random
+import threading
+import time
 from contextlib import contextmanager
 from sqlite3 import OperationalError
 
@@ -19,20 +22,59 @@ class DummyOperation(object):
             self.obj.delete()
 
 
+POSTGRES_LOCK_QUERY = "SELECT pg_advisory_xact_lock(%s) AS lock;"
+
+
 class PostgresLock(object):
     def __init__(self, key=None):
         self.key = key
 
     def execute(self):
-        query = "SELECT pg_advisory_xact_lock({key}) AS lock;".format(key=self.key)
         with connection.cursor() as c:
-            c.execute(query)
+            c.execute(POSTGRES_LOCK_QUERY, [self.key])
+
+
+# initial and maximum delay, in seconds, between attempts to acquire the SQLite lock
+SQLITE_LOCK_RETRY_DELAY = 0.001
+SQLITE_LOCK_MAX_RETRY_DELAY = 0.5
+
+
+# how deeply each thread has entered `db_lock`, per database connection alias
+_lock_depths = threading.local()
 
 
 @contextmanager
 def db_lock():
+    """
+    Acquires a lock on the database, which is reentrant within a thread so nested uses don't
+    acquire the lock again
+    """
+    depths = getattr(_lock_depths, "depths", None)
+    if depths is None:
+        depths = _lock_depths.depths = {}
+    alias = connection.alias
+
+    if depths.get(alias, 0) > 0:
+        depths[alias] += 1
+        try:
+            yield
+        finally:
+            depths[alias] -= 1
+        return
+
+    depths[alias] = 1
+    try:
+        with _db_lock():
+            yield
+    finally:
+        depths[alias] = 0
+
+
+@contextmanager
+def _db_lock():
     lock_id = 1
     if connection.vendor == "sqlite":
+        delay = SQLITE_LOCK_RETRY_DELAY
         while True:
             try:
                 with transaction.atomic():
@@ -44,6 +86,9 @@ def db_lock():
             except OperationalError as e:
                 if "database is locked" not in str(e):
                     raise e
+                # back off with jitter, rather than spinning, so the lock holder can finish
+                time.sleep(delay + random.random() * delay)
+                delay = min(delay * 2, SQLITE_LOCK_MAX_RETRY_DELAY)
     elif connection.vendor == "postgresql":
         with transaction.atomic():
             operation = PostgresLock(key=lock_id)